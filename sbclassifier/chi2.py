@@ -1,62 +1,99 @@
 import math as _math
+import sys as _sys
 import random
 
 
-def chi2Q(x2, v, exp=_math.exp, min=min):
+def chi2Q(x2, v):
     """Return prob(chisq >= x2, with v degrees of freedom).
 
     v must be even.
     """
     assert v & 1 == 0
-    # XXX If x2 is very large, exp(-m) will underflow to 0.
-    m = x2 / 2.0
-    sum = term = exp(-m)
-    for i in range(1, v // 2):
-        term *= m / i
+    # For even v this is the regularized upper incomplete gamma function.
+    return gammaincc(v // 2, x2 / 2.0)
+
+
+def gammaincc(n, x, exp=_math.exp, min=min):
+    """Return the regularized upper incomplete gamma function Q(n, x).
+
+    n must be a positive integer, in which case Q(n, x) is the probability
+    that a Poisson variable with mean x is less than n.
+    """
+    sum = term = exp(-x)
+    if term < _sys.float_info.min:
+        # exp(-x) underflowed to zero or to a subnormal with too few
+        # significant bits to build the sum on, but the sum as a whole might
+        # still be representable.
+        return _gammaincc_scaled(n, x)
+    # The terms grow while i <= x and shrink after that.  Once a shrinking
+    # term no longer changes the sum none of the later ones can either, so
+    # the loop can stop early without changing the result.  For the small
+    # x typical of the ham measure on spam (and vice versa) this skips most
+    # of the n iterations.
+    k = min(n, int(x) + 1)
+    for i in range(1, k):
+        term *= x / i
         sum += term
-    # With small x2 and large v, accumulated roundoff error, plus error in
+    for i in range(k, n):
+        term *= x / i
+        if sum + term == sum:
+            break
+        sum += term
+    # With small x and large n, accumulated roundoff error, plus error in
     # the platform exp(), can cause this to spill a few ULP above 1.0.  For
     # example, chi2Q(100, 300) on my box has sum == 1.0 + 2.0**-52 at this
     # point.  Returning a value even a teensy bit over 1.0 is no good.
     return min(sum, 1.0)
 
 
+def _gammaincc_scaled(
+    n, x, exp=_math.exp, log=_math.log, lgamma=_math.lgamma, min=min
+):
+    """Return Q(n, x) for x large enough that exp(-x) underflows.
+
+    The series is summed relative to its largest term, exp(-x) * x**p / p!,
+    whose logarithm is representable even when exp(-x) itself is not.
+    """
+    p = min(n - 1, int(x))
+    sum = 1.0
+    # Terms below the peak, shrinking as i decreases.
+    term = 1.0
+    for i in range(p, 0, -1):
+        term *= i / x
+        if sum + term == sum:
+            break
+        sum += term
+    # Terms above the peak, shrinking as i increases.
+    term = 1.0
+    for i in range(p + 1, n):
+        term *= x / i
+        if sum + term == sum:
+            break
+        sum += term
+    return min(exp(-x + p * log(x) - lgamma(p + 1) + log(sum)), 1.0)
+
+
 def normZ(z, sqrt2pi=_math.sqrt(2.0 * _math.pi), exp=_math.exp):
     "Return value of the unit Gaussian at z."
     return exp(-z * z / 2.0) / sqrt2pi
 
 
-def normP(z):
+def normP(z, erfc=_math.erfc, sqrt2=_math.sqrt(2.0)):
     """Return area under the unit Gaussian from -inf to z.
 
     This is the probability that a zscore is <= z.
     """
 
-    # This is very accurate in a fixed-point sense.  For negative z of
-    # large magnitude (<= -8.3), it returns 0.0, essentially because
-    # P(-z) is, to machine precision, indistiguishable from 1.0 then.
-
-    # sum <- area from 0 to abs(z).
-    a = abs(float(z))
-    if a >= 8.3:
-        sum = 0.5
-    else:
-        sum2 = term = a * normZ(a)
-        z2 = a * a
-        sum = 0.0
-        i = 1.0
-        while sum != sum2:
-            sum = sum2
-            i += 2.0
-            term *= z2 / i
-            sum2 += term
-
-    if z >= 0:
-        result = 0.5 + sum
-    else:
-        result = 0.5 - sum
-
-    return result
+    # This used to sum the Taylor series for the area from 0 to abs(z) in
+    # Python; math.erfc computes the same thing in C, agrees with the series
+    # to within a couple of ULP, and is more accurate in the lower tail.
+    # For z of magnitude >= 8.3 the result is, to machine precision,
+    # indistinguishable from 0.0 or 1.0, and is returned as such.
+    if z >= 8.3:
+        return 1.0
+    if z <= -8.3:
+        return 0.0
+    return 0.5 * erfc(-z / sqrt2)
 
 
 def normIQ(p, sqrt=_math.sqrt, ln=_math.log):
@@ -33,12 +33,11 @@
 #
 # This implementation is due to Tim Peters et alia.
 
+import heapq
 import math
+import operator
 
-from sbclassifier.chi2 import chi2Q
-
-
-LN2 = math.log(2)
+from sbclassifier.chi2 import gammaincc
 
 HAM_COUNT = 'nham'
 SPAM_COUNT = 'nspam'
@@ -46,6 +45,13 @@ HAM_PREFIX = 'h:'
 SPAM_PREFIX = 's:'
 
 
+def _unique(tokens):
+    """Return tokens as a set, without copying it if it already is one."""
+    if isinstance(tokens, (set, frozenset)):
+        return tokens
+    return set(tokens)
+
+
 class Classifier:
 
     unknown_token_prob = 0.5
@@ -58,6 +64,13 @@ class Classifier:
     def __init__(self, store):
         self.store = store
 
+        # Token probabilities depend only on the token's (spamcount,
+        # hamcount), the store's (nspam, nham) and the unknown_token_*
+        # attributes, so (distance, prob) clues are memoized by counts for as
+        # long as the others are unchanged.
+        self._prob_cache = {}
+        self._prob_cache_key = None
+
     # spamprob using the chi-squared implementation
     # Across vectors of length n, containing random uniformly-distributed
     # probabilities, -2*sum(ln(p_i)) follows the chi-squared distribution
@@ -91,34 +104,21 @@ class Classifier:
         # measure uses p directly (so that lo-spamprob tokens have greatest
         # effect).
         #
-        # For optimization, sum-of-logs == log-of-product, and f.p.
-        # multiplication is a lot cheaper than calling ln().  It's easy
-        # to underflow to 0.0, though, so we simulate unbounded dynamic
-        # range via frexp.  The real product H = this H * 2**Hexp, and
-        # likewise the real product S = this S * 2**Sexp.
-        H = S = 1.0
-        Hexp = Sexp = 0
-
-        clues = self._getclues(tokens)
-        for prob, token in clues:
-            S *= 1.0 - prob
-            H *= prob
-            if S < 1e-200:  # prevent underflow
-                S, e = math.frexp(S)
-                Sexp += e
-            if H < 1e-200:  # prevent underflow
-                H, e = math.frexp(H)
-                Hexp += e
-
-        # Compute the natural log of the product = sum of the logs:
-        # ln(x * 2**i) = ln(x) + i * ln(2).
-        S = math.log(S) + Sexp * LN2
-        H = math.log(H) + Hexp * LN2
-
-        n = len(clues)
+        # The logs are summed directly rather than multiplying the probs and
+        # taking the log of the product: this avoids having to guard the
+        # product against underflow, and pushes the per-clue work into map()
+        # rather than a Python level loop.  fsum keeps the sum exact, so no
+        # precision is lost over max_discriminators terms.
+        probs, clue_tokens = self._getclues(tokens)
+        S = math.fsum(map(math.log1p, map(operator.neg, probs)))
+        H = math.fsum(map(math.log, probs))
+
+        n = len(probs)
         if n:
-            S = 1.0 - chi2Q(-2.0 * S, 2 * n)
-            H = 1.0 - chi2Q(-2.0 * H, 2 * n)
+            # -2 * S is chi-squared with 2n degrees of freedom, and
+            # chi2Q(-2 * S, 2 * n) == gammaincc(n, -S).
+            S = 1.0 - gammaincc(n, -S)
+            H = 1.0 - gammaincc(n, -H)
 
             # How to combine these into a single spam score?  We originally
             # used (S-H)/(S+H) scaled into [0., 1.], which equals S/(S+H).  A
@@ -133,8 +133,9 @@ class Classifier:
             prob = 0.5
 
         if evidence:
-            clues = [(w, p) for p, w in clues]
-            clues.sort(key=lambda a: a[1])
+            clues = sorted(
+                zip(clue_tokens, probs), key=lambda a: (a[1], a[0])
+            )
             clues.insert(0, ("*S*", S))
             clues.insert(0, ("*H*", H))
             return prob, clues
@@ -171,62 +172,97 @@ class Classifier:
         # There does appear to be some useful info in how many times a token
         # appears in a msg, but distorting spamprob doesn't appear a correct
         # way to exploit it.
-        self.store.add_spam(set(tokens))
+        self.store.add_spam(_unique(tokens))
 
     def add_ham(self, tokens):
-        self.store.add_ham(set(tokens))
+        self.store.add_ham(_unique(tokens))
 
     def remove_spam(self, tokens):
-        self.store.remove_spam(set(tokens))
+        self.store.remove_spam(_unique(tokens))
 
     def remove_ham(self, tokens):
-        self.store.remove_ham(set(tokens))
-
-    # Return list of (prob, token, record) triples, sorted by increasing prob.
-    # "token" is a token from tokens; "prob" is its spamprob (a float in 0.0
-    # through 1.0); and "record" is token's associated WordInfo record if token
-    # is in the training database, or None if it's not. No more than
-    # max_discriminators items are returned, and have the strongest (farthest
-    # from 0.5) spamprobs of all tokens in tokens. Tokens with spamprobs less
-    # than minimum_prob_strength away from 0.5 aren't returned.
+        self.store.remove_ham(_unique(tokens))
+
+    # Return a pair of parallel lists (probs, tokens), in no particular order.
+    # "tokens" are tokens from tokens; "probs" are their spamprobs (floats in
+    # 0.0 through 1.0). No more than max_discriminators items are returned,
+    # and have the strongest (farthest from 0.5) spamprobs of all tokens in
+    # tokens. Tokens with spamprobs less than minimum_prob_strength away from
+    # 0.5 aren't returned.
     def _getclues(self, tokens):
-        tokens = set(tokens)
+        tokens = _unique(tokens)
         counts = self.store.get_token_counts(tokens)
 
+        # The tuning attributes may be changed on an instance at any time, so
+        # they are part of what the memoized probabilities depend on.
+        totals = self.store.get_nspam_nham()
+        unknown_token_prob = self.unknown_token_prob
+        cache_key = totals, unknown_token_prob, self.unknown_token_strength
+        if cache_key != self._prob_cache_key:
+            self._prob_cache = {}
+            self._prob_cache_key = cache_key
+
+        # Known tokens are scored straight from their counts; every unknown
+        # token gets the same clue, so they need only be visited at all if
+        # that clue is strong enough to keep.
+        minimum_prob_strength = self.minimum_prob_strength
+        cache = self._prob_cache
         clues = []
-        for token in tokens:
-            tup = self._worddistanceget(counts, token)
-            if tup[0] >= self.minimum_prob_strength:
-                clues.append(tup)
-        clues.sort()
-
-        return [
-            (prob, token)
-            for distance, prob, token in clues[:self.max_discriminators]
-        ]
-
-    def _worddistanceget(self, counts, token):
-        tup = counts.get(token)
-        if tup:
-            prob = self.probability(*tup)
-        else:
-            prob = self.unknown_token_prob
-        return abs(prob - 0.5), prob, token
-
-    def probability(self, spamcount, hamcount):
+        for token, tup in counts.items():
+            clue = cache.get(tup)
+            if clue is None:
+                prob = self.probability(*tup, *totals)
+                clue = cache[tup] = (abs(prob - 0.5), prob)
+            if clue[0] >= minimum_prob_strength:
+                clues.append((*clue, token))
+
+        distance = abs(unknown_token_prob - 0.5)
+        if distance >= minimum_prob_strength:
+            clues.extend(
+                (distance, unknown_token_prob, token)
+                for token in tokens
+                if token not in counts
+            )
+
+        # Keep the strongest max_discriminators clues.  A bounded heap only
+        # beats sorting everything once there are many more candidates than
+        # are wanted: list.sort runs in C, heapq.nlargest mostly doesn't.
+        # Nothing depends on the order of the clues, so when there are few
+        # enough to keep them all they aren't sorted at all.
+        limit = self.max_discriminators
+        if len(clues) > limit * 16:
+            clues = heapq.nlargest(limit, clues)
+        elif len(clues) > limit:
+            clues.sort(reverse=True)
+            del clues[limit:]
+
+        return (
+            [prob for distance, prob, token in clues],
+            [token for distance, prob, token in clues],
+        )
+
+    def probability(self, spamcount, hamcount, nspam=None, nham=None):
         """Compute, store, and return prob(msg is spam | msg contains token).
 
         This is the Graham calculation, but stripped of biases, and stripped of
         clamping into 0.01 thru 0.99.  The Bayesian adjustment following keeps
         them in a sane range, and one that naturally grows the more evidence
         there is to back up a probability.
+
+        nspam and nham are the store's message totals. They are fetched from
+        the store if not given. A consistent store never has spamcount >
+        nspam or hamcount > nham; this is not checked here.
         """
-        nspam, nham = self.store.get_nspam_nham()
+        if nspam is None or nham is None:
+            nspam, nham = self.store.get_nspam_nham()
         nspam = nspam or 1.0
         nham = nham or 1.0
 
-        assert hamcount <= nham, "Token seen in more ham than ham trained."
-        assert spamcount <= nspam, "Token seen in more spam than spam trained."
+        n = hamcount + spamcount
+        if not n:
+            # No evidence either way, which Robinson's adjustment below
+            # would reduce to unknown_token_prob anyway.
+            return self.unknown_token_prob
 
         hamratio = hamcount / nham
         spamratio = spamcount / nspam
@@ -251,5 +287,4 @@ class Classifier:
         #
         # IOW, it moves p a fraction of the distance from p to x, and
         # less so the larger n is, or the smaller s is.
-        n = hamcount + spamcount
         return (StimesX + n * prob) / (S + n)
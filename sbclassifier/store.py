@@ -1,6 +1,8 @@
+import itertools
+
 
 class BaseStore:
-    def get_nspam_nham(self, tokens):
+    def get_nspam_nham(self):
         raise NotImplementedError()
 
     def get_token_counts(self, tokens):
@@ -21,53 +23,62 @@ class BaseStore:
 
 class HeapStore(BaseStore):
     def __init__(self):
-        self.spam = {}
-        self.ham = {}
+        # Map of token -> (spamcount, hamcount). Storing immutable pairs
+        # lets get_token_counts hand them out without copying.
+        self.counts = {}
         self.nspam = 0
         self.nham = 0
 
-    def _increment(self, dct, keys):
+    def _increment(self, ds, dh, keys, zero=(0, 0)):
+        counts = self.counts
         for key in keys:
-            dct[key] = dct.get(key, 0) + 1
+            spam, ham = counts.get(key, zero)
+            counts[key] = (spam + ds, ham + dh)
 
-    def _decrement(self, dct, keys):
+    def _decrement(self, ds, dh, keys):
+        counts = self.counts
         for key in keys:
-            if key in dct:
-                dct[key] = dct.get(key, 0) - 1
+            entry = counts.get(key)
+            if entry is not None:
+                spam, ham = entry
+                counts[key] = (max(0, spam - ds), max(0, ham - dh))
 
     def get_nspam_nham(self):
         return self.nspam, self.nham
 
     def get_token_counts(self, tokens):
+        counts = self.counts
         return {
-            w: (
-                self.spam.get(w, 0),
-                self.ham.get(w, 0)
-            )
+            w: entry
             for w in tokens
-            if w in self.spam or w in self.ham
+            if (entry := counts.get(w)) is not None
         }
 
     def add_spam(self, tokens):
-        self._increment(self.spam, tokens)
+        self._increment(1, 0, tokens)
         self.nspam += 1
 
     def add_ham(self, tokens):
-        self._increment(self.ham, tokens)
+        self._increment(0, 1, tokens)
         self.nham += 1
 
     def remove_spam(self, tokens):
-        self._decrement(self.spam, tokens)
-        self.nspam -= 1
+        self._decrement(1, 0, tokens)
+        self.nspam = max(0, self.nspam - 1)
 
     def remove_ham(self, tokens):
-        self._decrement(self.ham, tokens)
-        self.nham -= 1
+        self._decrement(0, 1, tokens)
+        self.nham = max(0, self.nham - 1)
 
 
 class SqliteStore(BaseStore):
     DOC_COUNT_TOKEN = ' $DOC_COUNT$ '
 
+    # Tokens are looked up in batches of this size, which is below
+    # SQLite's default limit on the number of host parameters in a
+    # statement for all versions.
+    MAX_VARIABLES = 999
+
     def __init__(self, db):
         self.db = db
         self.db.execute(
@@ -78,55 +89,62 @@ class SqliteStore(BaseStore):
 
     def _upsert(self, tokens, spam, ham):
         self.db.executemany(
-            f"INSERT INTO tokens(token, spam, ham) "
-            f"VALUES (?, {spam}, {ham}) "
-            f"ON CONFLICT(token) DO UPDATE "
-            f"SET "
-                f"spam = spam + {spam},"
-                f"ham = ham + {ham}",
-            ((t,) for t in tokens)
+            "INSERT INTO tokens(token, spam, ham) "
+            "VALUES (?, ?, ?) "
+            "ON CONFLICT(token) DO UPDATE "
+            "SET "
+                "spam = spam + excluded.spam, "
+                "ham = ham + excluded.ham",
+            ((t, spam, ham) for t in tokens)
         )
 
     def _update(self, tokens, spam, ham):
+        # Only tokens already in the table are touched, and counts are
+        # clamped at zero, so removing a message that was never added can't
+        # create rows or leave negative counts to skew later training.
         self.db.executemany(
-            f"UPDATE tokens SET "
-                f"spam = spam + {spam} "
-                f"ham = ham + {ham} "
-            f"WHERE token = ?",
-            keys
+            "UPDATE tokens "
+            "SET "
+                "spam = max(0, spam + ?), "
+                "ham = max(0, ham + ?) "
+            "WHERE token = ?",
+            ((spam, ham, t) for t in tokens)
         )
 
     def get_nspam_nham(self):
-        counts = self.get_token_counts((self.DOC_COUNT_TOKEN,))
-        dc = counts.get(self.DOC_COUNT_TOKEN)
+        dc = self.db.execute(
+            "SELECT max(0, spam), max(0, ham) "
+            "FROM tokens "
+            "WHERE token = ?",
+            (self.DOC_COUNT_TOKEN,)
+        ).fetchone()
         if dc:
             return dc
         return 0, 0
 
     def get_token_counts(self, tokens):
-        return {
-            w: row
-            for w in tokens
-            for row in self.db.execute(
-                "SELECT max(0, spam), max(0, ham)"
-                "FROM tokens "
-                "WHERE token = ?",
-                (w,)
-            )
-        }
+        tokens = tuple(tokens)
+        counts = {}
+        for ix in range(0, len(tokens), self.MAX_VARIABLES):
+            chunk = tokens[ix:ix + self.MAX_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.db.execute(
+                f"SELECT token, max(0, spam), max(0, ham) "
+                f"FROM tokens "
+                f"WHERE token IN ({placeholders})",
+                chunk
+            ).fetchall()
+            counts.update({token: (spam, ham) for token, spam, ham in rows})
+        return counts
 
     def add_spam(self, tokens):
-        self._upsert(tokens, 1, 0)
-        self._upsert([self.DOC_COUNT_TOKEN], 1, 0)
+        self._upsert(itertools.chain(tokens, [self.DOC_COUNT_TOKEN]), 1, 0)
 
     def add_ham(self, tokens):
-        self._upsert(tokens, 0, 1)
-        self._upsert([self.DOC_COUNT_TOKEN], 0, 1)
+        self._upsert(itertools.chain(tokens, [self.DOC_COUNT_TOKEN]), 0, 1)
 
     def remove_spam(self, tokens):
-        self._update(tokens, -1, 0)
-        self._upsert([self.DOC_COUNT_TOKEN], -1, 0)
+        self._update(itertools.chain(tokens, [self.DOC_COUNT_TOKEN]), -1, 0)
 
     def remove_ham(self, tokens):
-        self._update(tokens, 0, -1)
-        self._upsert([self.DOC_COUNT_TOKEN], 0, -1)
+        self._update(itertools.chain(tokens, [self.DOC_COUNT_TOKEN]), 0, -1)
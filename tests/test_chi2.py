@@ -0,0 +1,47 @@
+import math
+import sys
+
+from sbclassifier.chi2 import chi2Q
+from sbclassifier.chi2 import gammaincc
+from sbclassifier.chi2 import normP
+
+
+def test_chi2Q_matches_full_series():
+    def full_series(x2, v):
+        m = x2 / 2.0
+        sum = term = math.exp(-m)
+        for i in range(1, v // 2):
+            term *= m / i
+            sum += term
+        return min(sum, 1.0)
+
+    for v in (2, 4, 10, 100, 300, 1100):
+        for x2 in (0.0, 0.5, 3.0, 10.0, 99.0, 100.0, 299.0, 301.0, 600.0):
+            assert chi2Q(x2, v) == full_series(x2, v)
+
+    # Both the early exit and the full loop at the usual clue count
+    for x2 in (10.0, 40.0, 290.0, 310.0, 800.0, 1400.0):
+        assert chi2Q(x2, 300) == full_series(x2, 300)
+
+
+def test_gammaincc_does_not_underflow_for_large_x():
+    # exp(-800) underflows to 0.0, but Q(150, 800) ~= 4.299e-176 does not.
+    assert math.exp(-800) == 0.0
+    assert math.isclose(gammaincc(150, 800.0), 4.2990975122215245e-176)
+    assert gammaincc(150, 800.0) == chi2Q(1600.0, 300)
+    assert gammaincc(2000, 800.0) == 1.0
+
+
+def test_gammaincc_is_accurate_when_exp_is_subnormal():
+    # exp(-744) is subnormal, with only a few significant bits.
+    assert 0.0 < math.exp(-744) < sys.float_info.min
+    assert math.isclose(gammaincc(150, 744.0), 1.842233586598595e-156)
+    assert math.isclose(gammaincc(150, 740.0), 4.510942290729220e-155)
+
+
+def test_normP():
+    assert normP(0.0) == 0.5
+    assert math.isclose(normP(1.0), 0.8413447460685429)
+    assert math.isclose(normP(-2.0), 0.022750131948179195)
+    assert normP(8.3) == 1.0
+    assert normP(-8.3) == 0.0
@@ -0,0 +1,58 @@
+from sbclassifier import Classifier
+from sbclassifier import HeapStore
+
+
+def test_it_recalculates_probabilities_after_training():
+    classifier = Classifier(HeapStore())
+    classifier.add_spam(["buy", "now"])
+    classifier.add_ham(["hello", "now"])
+    before = classifier.spamprob(["buy"])
+
+    classifier.add_ham(["buy"])
+    classifier.add_ham(["buy"])
+    assert classifier.spamprob(["buy"]) < before
+
+
+def test_it_uses_the_strongest_clues():
+    classifier = Classifier(HeapStore())
+    classifier.max_discriminators = 2
+    for _ in range(5):
+        classifier.add_spam(["viagra", "offer"])
+        classifier.add_ham(["hello", "offer"])
+    classifier.add_spam(["now"])
+    classifier.add_ham(["meeting"])
+
+    prob, evidence = classifier.spamprob(
+        ["viagra", "hello", "now", "meeting", "offer"], evidence=True
+    )
+    assert [token for token, p in evidence[2:]] == ["hello", "viagra"]
+
+
+def test_it_scores_untrained_tokens_as_unknown():
+    classifier = Classifier(HeapStore())
+    classifier.add_spam(["buy"])
+    classifier.add_ham(["hello"])
+    classifier.remove_spam(["buy"])
+    assert classifier.probability(0, 0) == classifier.unknown_token_prob
+    assert classifier.spamprob(["buy", "hello"]) < 0.5
+
+
+def test_it_uses_tuning_attributes_changed_after_construction():
+    def evidence(classifier):
+        classifier.add_spam(["a"])
+        classifier.add_ham(["b"])
+        return classifier.spamprob(["zz", "yy", "a"], evidence=True)[1][2:]
+
+    class Tuned(Classifier):
+        unknown_token_prob = 0.9
+        unknown_token_strength = 5
+
+    classifier = Classifier(HeapStore())
+    before = evidence(classifier)
+    classifier.unknown_token_prob = 0.9
+    classifier.unknown_token_strength = 5
+    after = classifier.spamprob(["zz", "yy", "a"], evidence=True)[1][2:]
+
+    assert after != before
+    assert after == evidence(Tuned(HeapStore()))
+    assert sorted(token for token, p in after) == ["a", "yy", "zz"]
@@ -0,0 +1,63 @@
+import sqlite3
+
+from sbclassifier import HeapStore
+from sbclassifier import SqliteStore
+
+
+def test_sqlite_store_gets_counts_for_many_tokens():
+    store = SqliteStore(sqlite3.connect(":memory:"))
+    tokens = [f"t{ix}" for ix in range(SqliteStore.MAX_VARIABLES * 2 + 1)]
+    store.add_spam(tokens)
+    store.add_ham(tokens[:10])
+
+    counts = store.get_token_counts(tokens + ["unknown"])
+    assert len(counts) == len(tokens)
+    assert counts["t0"] == (1, 1)
+    assert counts[tokens[-1]] == (1, 0)
+    assert store.get_nspam_nham() == (1, 1)
+
+
+def test_heap_store_counts_spam_and_ham():
+    store = HeapStore()
+    store.add_spam(["a", "b"])
+    store.add_ham(["b", "c"])
+    store.remove_spam(["a", "c"])
+
+    assert store.get_token_counts(["a", "b", "c", "d"]) == {
+        "a": (0, 0),
+        "b": (1, 1),
+        "c": (0, 1),
+    }
+    assert store.get_nspam_nham() == (0, 1)
+
+
+def test_sqlite_store_removes_messages():
+    store = SqliteStore(sqlite3.connect(":memory:"))
+    store.add_spam(["a", "b"])
+    store.add_ham(["b", "c"])
+    store.remove_spam(["a", "c", "d"])
+    store.remove_ham(["e"])
+
+    assert store.get_token_counts(["a", "b", "c", "d", "e"]) == {
+        "a": (0, 0),
+        "b": (1, 1),
+        "c": (0, 1),
+    }
+    assert store.get_nspam_nham() == (0, 0)
+
+    # Counts don't go below zero
+    store.add_spam(["c", "d", "e"])
+    assert store.get_token_counts(["c", "d", "e"]) == {
+        "c": (1, 1),
+        "d": (1, 0),
+        "e": (1, 0),
+    }
+
+
+def test_stores_agree_on_removing_untrained_tokens():
+    for store in (HeapStore(), SqliteStore(sqlite3.connect(":memory:"))):
+        store.add_spam(["a"])
+        store.remove_spam(["a", "d"])
+        store.remove_ham(["e"])
+        assert store.get_token_counts(["a", "d", "e"]) == {"a": (0, 0)}
+        assert store.get_nspam_nham() == (0, 0)